@@ -7,9 +7,12 @@ import argparse
 from pathlib import Path
 import re
 import os
+import sys
 from datetime import *
 import collections
-import pickle
+import concurrent.futures
+import functools
+import json
 
 ####################
 ##
@@ -27,6 +30,7 @@ parser.add_argument("-C","--computers",help="input file containing computers. e.
 parser.add_argument("-U","--users",help="input file containing users. e.g. users.txt",required=False)
 parser.add_argument("--logonCount",help="int value for how many logons you believe indicates an active user. Default is 100",required=False)
 parser.add_argument("--logonDate",help="int value for how many days old a users last logon can be while still being active. Default is 30",required=False)
+parser.add_argument("--cache",action="store_true",help="Cache the parsed data in the output directory, and reuse it on later runs while the input files are unchanged.")
 args = parser.parse_args()
 
 ####################
@@ -37,10 +41,10 @@ args = parser.parse_args()
 ####################
 
 # What field you want your markdown files to be named off of?
-# Currently this script does not check to ensure that the name does not
-# Include "/\:" characters, which are forbidden by Obsidian in filenames
-# If you choose a filename_seed that might have those characters in it
-# You will have a bad time (or need to update the logic)
+# Characters that can't go in a filename (like "/\:") are swapped for
+# underscores by safeFileName, so two names that only differ in those
+# characters would end up with the same file. Writing (and merging, when
+# appending) warns about that and keeps the first one
 filenameSeed = "samaccountname"
 
 # What is the delimiter between the value name and the value?
@@ -52,10 +56,54 @@ logonCountThreshold = 100
 # Set threshhold date for stale logins. The default threshold is 30 days
 logonDateThreshold = 30
 
+# How many threads to use for writing out the .md files. Writing is
+# dominated by open/write/close latency rather than CPU, so we can run
+# well past the core count
+writerThreads = min(32, (os.cpu_count() or 1) * 4)
+
 # Set top level headers for the .md files
 headers = {'rawdata': '# Raw Data:', 'tags': '# Tags:', 'time': '# Clean Timestamps:', 'members': '# Members:', 'parents': '# Parents:', 'uac': '# UserAccountControl Values:', 'userDefined': '# User Defined:'}
 
-
+# The same headers as a frozenset, used when appending to spot section
+# breaks, since every line of every existing file gets checked against it
+headerVals = frozenset(headers.values())
+
+# How each section starts when a file is rendered, header included, glued
+# together once here rather than again for every file written
+rawDataStart = headers['rawdata'] + "\n\n```plaintext raw\n"
+membersStart = "\n" + headers['members']
+parentsStart = "\n" + headers['parents']
+tagsStart = "\n" + headers['tags']
+uacStart = "\n" + headers['uac'] + "\n"
+timeStart = "\n" + headers['time']
+userDefinedStart = "\n" + headers['userDefined']
+
+# Pattern used when appending to pull the bare name back out of an
+# Obsidian link we wrote earlier, e.g. "[[GROUPS/Domain Admins]]" or
+# "[[Domain Admins]]". Compiled once here since it runs against every
+# member and parent line of every existing file.
+wikiLinkPattern = re.compile(r'^\[\[(?:.*/)?(.*?)\]\]$')
+
+# The first part of a DN ("CN=username" in "CN=username,OU=blah"),
+# allowing for commas escaped with a backslash, and the escapes
+# themselves so they can be taken back out
+dnNamePattern = re.compile(r'^\w+=((?:\\.|[^,\\])*)')
+dnEscapePattern = re.compile(r'\\(.)')
+
+
+
+# Characters that can't go in a file name on at least one of the systems
+# a vault might be synced to. Names are run through this table with
+# str.translate before being used as a file name or link, so a
+# samaccountname with one of these in it still gets its own note
+fileNameTable = str.maketrans({c: '_' for c in '/\\:*?"<>|'})
+
+# Where --cache keeps the parsed data between runs. The leading dot keeps
+# it out of the way in Obsidian
+cacheFile = args.directory + "/.shihtzu.cache"
+# Bumped whenever the layout of the cached records changes, so a cache
+# written by an older version gets ignored rather than misread
+cacheFormat = 3
 
 userPath = args.directory + "/USERS"
 groupPath = args.directory + "/GROUPS"
@@ -73,6 +121,21 @@ if args.logonDate and type(int(args.logonDate)) == int:
 elif args.logonDate and type(int(args.logonDate)) != int:
 	print("logonDate value needs to be an integer!")
 
+# Anything that last logged on before this is a stale logon. Worked out
+# once here rather than again for every timestamp of every object, and
+# kept as unix seconds so the check is a plain number comparison against
+# what getUnixTime hands back, with no timezone to get mixed up
+staleLogonCutoff = datetime.now(timezone.utc).timestamp() - timedelta(days=logonDateThreshold).total_seconds()
+
+# The windows timestamp attributes we convert, along with the
+# "name: " prefix each one gets in the clean timestamps section
+timeAttributes = ('pwdlastset', 'badpasswordtime', 'lastlogon', 'lastlogontimestamp')
+timePrefixes = {attr: attr + delimiter for attr in timeAttributes}
+
+# Everything that is read from an element after it has been parsed and
+# tagged: what gets written out, plus what the admin tagging needs
+recordKeys = ('rawdata', 'member', 'memberof', 'tags', 'uacval', 'admincount', 'samaccountname') + timeAttributes
+
 
 ####################
 ##
@@ -80,66 +143,75 @@ elif args.logonDate and type(int(args.logonDate)) != int:
 ##
 ####################
 
+# Windows timestamps count 100 nanosecond ticks from Jan 1 1601 00:00.00
+# UTC. These are the ticks between then and the unix epoch, and the
+# ticks in a second
+windowsEpochTicks = 116444736000000000
+windowsTicksPerSecond = 10000000
+
 #Taken from impacket GetADUsers.py
 def getUnixTime(t):
-	# This is like Jan 1 1607 00:00.00 UTC
-	t-= 116444736000000000
-	# Windows uses like 100 nanosecond ticks, so get rid of that to handle unix more simply
-	t /= 10000000
+	# Split into whole seconds and leftover ticks with integer maths, so
+	# the seconds are exact and only the fraction goes through a float
+	# (dividing the whole tick count as a float loses precision)
+	seconds, ticks = divmod(t - windowsEpochTicks, windowsTicksPerSecond)
+	t = seconds + ticks / windowsTicksPerSecond
 	# The following line causes recusion errors, so remember to do this when you want it.
 	#t = str(datetime.fromtimestamp(self.getUnixTime(t)))
 	return t
 
+# UserAccountControl flags and their bit values, highest bit first so the
+# decoded list reads in the same order as Microsoft's documentation.
+# Bits 0x4, 0x400, 0x4000 and 0x8000 are unused and so are left out.
+uacFlags = ((0x1000000, "ADS_UF_TRUSTED_TO_AUTHENTICATE_FOR_DELEGATION"), (0x800000, "ADS_UF_PASSWORD_EXPIRED"), (0x400000, "ADS_UF_DONT_REQUIRE_PREAUTH"), (0x200000, "ADS_UF_USE_DES_KEY_ONLY"), (0x100000, "ADS_UF_NOT_DELEGATED"), (0x80000, "ADS_UF_TRUSTED_FOR_DELEGATION"), (0x40000, "ADS_UF_SMARTCARD_REQUIRED"), (0x20000, "ADS_UF_MNS_LOGON_ACCOUNT"), (0x10000, "ADS_UF_DONT_EXPIRE_PASSWD"), (0x2000, "ADS_UF_SERVER_TRUST_ACCOUNT"), (0x1000, "ADS_UF_WORKSTATION_TRUST_ACCOUNT"), (0x800, "ADS_UF_INTERDOMAIN_TRUST_ACCOUNT"), (0x200, "ADS_UF_NORMAL_ACCOUNT"), (0x100, "ADS_UF_TEMP_DUPLICATE_ACCOUNT"), (0x80, "ADS_UF_ENCRYPTED_TEXT_PASSWORD_ALLOWED"), (0x40, "ADS_UF_PASSWD_CANT_CHANGE"), (0x20, "ADS_UF_PASSWD_NOTREQD"), (0x10, "ADS_UF_LOCKOUT"), (0x8, "ADS_UF_HOMEDIR_REQUIRED"), (0x2, "ADS_UF_ACCOUNTDISABLE"), (0x1, "ADS_UF_SCRIPT"))
+
+# The flags we tag on and the tag each one gets, in the order the tags
+# are added. Each entry is a mask, so the tagging can test the raw
+# useraccountcontrol integer directly instead of searching the list of
+# decoded names. Any bit in the mask being set is enough for the tag
+uacTags = (
+	(0x40000, "#SmartcardRequired"),
+	(0x10 | 0x2, '#BadAccount due to #DisabledOrLockedAccount at this Domain Controller'),
+	(0x800000, '#BadAccount because #PasswordExpired at this Domain Controller'),
+	(0x1000000 | 0x80000, '#DelegationOpportunity'),
+	(0x200, '#NormalAccount'),
+	(0x2000, "#ServerTrustAccount"),
+)
+
+# The obsidian link for every flag name, built once here rather than
+# glued together again for every object that has the flag
+uacLinks = {name: "[[UserAccountControlValues#" + name + "]]" for bit, name in uacFlags}
+
+# useraccountcontrol is a plain bitfield, so a flag is set exactly
+# when its bit is set in the value. One AND per flag is all we need.
+# Only a handful of distinct values turn up across a whole domain, so
+# the decoded flags (and the tags that go with them) are cached per
+# value. They're cached as tuples so nobody can change the cached copy
+# by accident
+@functools.lru_cache(maxsize=None)
+def uacFlagNames(val):
+	return tuple(name for bit, name in uacFlags if val & bit)
+
+@functools.lru_cache(maxsize=None)
+def uacTagsFor(val):
+	return tuple(tag for mask, tag in uacTags if val & mask)
+
 #Individually developed	
 def useraccountcalc(val):
-	# Convert the decimal value to hex, and then get rid of the "0x" at the front
-	val = int(hex(int(val))[2:])
-	# Create list of attributes and associated hex values for those attributes
-	attrs = ["ADS_UF_TRUSTED_TO_AUTHENTICATE_FOR_DELEGATION", "ADS_UF_PASSWORD_EXPIRED", "ADS_UF_DONT_REQUIRE_PREAUTH", "ADS_UF_USE_DES_KEY_ONLY", "ADS_UF_NOT_DELEGATED", "ADS_UF_TRUSTED_FOR_DELEGATION", "ADS_UF_SMARTCARD_REQUIRED", "ADS_UF_MNS_LOGON_ACCOUNT", "ADS_UF_DONT_EXPIRE_PASSWD", "N/A", "N/A", "ADS_UF_SERVER_TRUST_ACCOUNT", "ADS_UF_WORKSTATION_TRUST_ACCOUNT", "ADS_UF_INTERDOMAIN_TRUST_ACCOUNT", "ADS_UF_NORMAL_ACCOUNT", "ADS_UF_TEMP_DUPLICATE_ACCOUNT", "ADS_UF_ENCRYPTED_TEXT_PASSWORD_ALLOWED", "ADS_UF_PASSWD_CANT_CHANGE", "ADS_UF_PASSWD_NOTREQD", "ADS_UF_LOCKOUT", "ADS_UF_HOMEDIR_REQUIRED", "ADS_UF_ACCOUNTDISABLE", "ADS_UF_SCRIPT"]
-	nums = [1000000, 800000, 400000, 200000, 100000, 80000, 40000, 20000, 10000, 8000, 4000, 2000, 1000, 800, 200, 100, 80, 40, 20, 10, 8, 2, 1]
-	# Initialize "attributes" list which will store the attributes
-	#	denoted by a given useraccountcontrol value
-	attributes = []
-	# Start loops to iterate through our useraccountcontrol value until
-	# all applied attributes are identified
-	while val > 0:
-		# step through each element of the list at a given index
-		for i in range(len(nums)):
-			''' Uncomment elements of this block if you need to debug
-			print(test[i])
-			print(i)
-			print(nums[i])
-			'''
-			# If our value is greater than or equal to a given hex value
-			# then we know that it contains that value. So remove the
-			# value and append the attribute at that index
-			if val >= nums[i]:
-				attributes.append(attrs[i])
-				val -= nums[i]
-			else:
-				# Go back to the start of the loop and start again
-				continue
-	# Return the list of applied attributes
-	return(attributes)
+	# Hand back a fresh list, since the append code adds to it
+	return list(uacFlagNames(val))
 
-def linkGroups(var):
-	var = "[[GROUPS/" + var + "]]"
-	return var
-
-def linkUsers(var):
-	var = "[[USERS/" + var + "]]"
-	return var
-
-def linkComputers(var):
-	var = "[[COMPUTERS/" + var + "]]"
-	return var
+def safeFileName(name):
+	return name.translate(fileNameTable)
 
 def linkUACAttributes(var):
-	var = "[[UserAccountControlValues#" + var + "]]"
-	return var
+	return "[[UserAccountControlValues#" + var + "]]"
 
-def addToAppropriateDict(dictname):
-	dictname.update({elementDict.get(filenameSeed)[0]: elementDict})
+# Only the attributes in recordKeys are kept once an element is filed,
+# the rest has already been used (objectclass, operatingsystem) or only
+# lives on in the raw data block. key is what the record is filed under
+def addToAppropriateDict(dictname, key, elementDict):
+	dictname[key] = {attr: elementDict[attr] for attr in recordKeys if attr in elementDict}
 
 # Block of functions to allow clean checks for object type. You could
 # also use samaccounttype values to help determine this, but this 
@@ -154,56 +226,63 @@ for fi in fileKeys:
 	print("Reading from " + files[fi])
 	with open(files[fi], 'r', encoding='utf-8-sig') as f:
 '''
-def isGroup():
-	if elementDict['objectclass']:
-		if "group" in elementDict['objectclass']:
-			return True
-		else:
-			return False
-	else:
-		if fi == groupsFile:
-			return True
-		else:
-			return False
-
-def isComputerAsUser():
-	if elementDict['objectclass']:
-
-		if "computer" in elementDict['objectclass'] and not elementDict['operatingsystem']:
-			return True
-		else:
-			return False
-	else:
-		if fi == computersFile:
-			return True
-		else:
-			return False
-			
-def isComputerAsComputer():
-	if elementDict['objectclass']:
-		if "computer" in elementDict['objectclass'] and elementDict['operatingsystem']:
-			return True
-		else:
-			return False
-	else:
-		if fi == computerFile:
-			return True
-		else:
-			return False
+#
+# Works out which dict an element belongs in, in one pass over its
+# objectclass values. Anything with a "computer" objectclass is a
+# computer, whether it came back with the computer attributes
+# (operatingsystem and so on) or only the user ones. With no objectclass
+# at all we go by which input file the element came from (the keys of
+# the files dict below), and anything else is a user.
+def classifyElement(objectClasses, source):
+	if objectClasses:
+		if "group" in objectClasses:
+			return groupDict
+		if "computer" in objectClasses:
+			return computerDict
+		return userDict
+	if source == "groupsFile":
+		return groupDict
+	if source == "computersFile":
+		return computerDict
+	return userDict
+
+# Pull the name out of a DN, e.g. "CN=username,OU=blah" -> "username".
+# The same DN turns up over and over (once in the member list of the
+# group and once in the memberof list of each of its members, at least)
+# so the results are cached rather than re-parsed every time.
+# The regex stops at the first comma that isn't escaped, so a name like
+# "CN=Smith\, John,OU=blah" comes out as "Smith, John" rather than
+# getting cut off at the backslash
+@functools.lru_cache(maxsize=None)
+def commonNameFromDN(dn):
+	match = dnNamePattern.match(dn)
+	if match:
+		return dnEscapePattern.sub(r'\1', match.group(1))
+	return dn[3:].split(',')[0]
+
+# Returns the lines inside the first ``` code fence in a list of
+# stripped lines, which is how the raw data block is written out
+def fencedLines(sectionLines):
+	data = []
+	inFence = False
+	for line in sectionLines:
+		if line.startswith("```"):
+			if inFence:
+				break
+			inFence = True
+		elif inFence:
+			data.append(line)
+	return data
 
 # This block cleans up the member values. Fret not! No data is
 # destroyed, since we still have rawdata as a dict entry. Also, I 
 # thought this function would be more useful than it was...
-def updateListEntryInDict(dictKey):
-	existingKeyList = elementDict[dictKey]
-	newlist = []
-	for val in existingKeyList:
-		# This cleans up from like cn=username,OU=blah
-		val = val[3:].split(',')[0]
-#		newlist.append(val.title())
-		newlist.append(val)
+def updateListEntryInDict(elementDict, dictKey, existingKeyList):
+	# This cleans up from like cn=username,OU=blah, in one comprehension
+	# with the (cached) name lookup bound to a local
+	cn = commonNameFromDN
 	# Now set the new value for members in the dict
-	elementDict.update({dictKey:newlist})
+	elementDict[dictKey] = [cn(val) for val in existingKeyList]
 	# Debug line:
 	#print(elementDict[dictKey])
 ''' If you want to get rid of this function above, you can use this block
@@ -225,224 +304,377 @@ to do this manually
 				#print(elementDict['member'])
 '''
 
+# Tags live in a plain list under 'tags', created on first use
+def addTag(obj, tag):
+	obj.setdefault('tags', []).append(tag)
+
 # Function beautifies ugly windows time vals and also tags stale logons
-def updateTimeEntryInDict(listOfKeys):
-	for key in listOfKeys:
-		if elementDict[key]:
+def updateTimeEntryInDict(elementDict, key, values):
+	#print(values)
+	# Some tools hand these back already formatted. A single int() call
+	# with a fallback is cheaper than validating the string first, and
+	# leaves non-numeric values untouched instead of killing the run
+	try:
+		Win64BitTime = int(values[0])
+	except ValueError:
+		return
+	#print(Win64BitTime)
+	if Win64BitTime != 0:
+			unixTime = getUnixTime(Win64BitTime)
+			cleantime = datetime.fromtimestamp(unixTime)
+			convertedTime = str(cleantime)
+			#print(convertedTime)
+			elementDict.update({key:convertedTime})
+			if key == "lastlogon":
+				if unixTime < staleLogonCutoff:
+					addTag(elementDict, "#BadAccount due to #StaleLogons at this Domain Controller")
+			elif key == "lastlogontimestamp":
+				if unixTime < staleLogonCutoff:
+					addTag(elementDict, "#BadAccount due to #StaleLogons replicated across the Domain. See info on 'lastlogontimestamp' attribute for more information.")
 			#print(elementDict[key])
-			Win64BitTime = int(elementDict[key][0])
-			#print(Win64BitTime)
-			if Win64BitTime != 0:
-					cleantime = datetime.fromtimestamp(getUnixTime(Win64BitTime))
-					convertedTime = str(cleantime)
-					#print(convertedTime)
-					elementDict.update({key:convertedTime})
-					if key == "lastlogon":
-						if cleantime < datetime.utcnow() - timedelta(days=logonDateThreshold):
-							elementDict['tags'].append("#BadAccount due to #StaleLogons at this Domain Controller")
-					elif key == "lastlogontimestamp":
-						if cleantime < datetime.utcnow() - timedelta(days=logonDateThreshold):
-							elementDict['tags'].append("#BadAccount due to #StaleLogons replicated across the Domain. See info on 'lastlogontimestamp' attribute for more information.")
-					#print(elementDict[key])
+
+# Tags accounts that have logged on fewer times than logonCountThreshold
+def tagLowLogonCount(elementDict, key, values):
+	try:
+		logoncount = int(values[0])
+	except ValueError:
+		return
+	#print(logoncount)
+	if logoncount < logonCountThreshold:
+		addTag(elementDict, '#BadAccount due to #LowLogonCount at this Domain Controller')
+
+# This will take the useraccountcontrol value, call a function to
+# calculate the relevant attributes, and apply them as tags.
+def tagUserAccountControl(elementDict, key, values):
+	try:
+		uacInt = int(values[0])
+	except ValueError:
+		return
+	# Create a new dictionary key of 'uacval' holding the decoded
+	# attributes (a flat list of flag names)
+	elementDict['uacval'] = useraccountcalc(uacInt)
+	tags = uacTagsFor(uacInt)
+	if tags:
+		elementDict.setdefault('tags', []).extend(tags)
+
+# I haven't ever seen this, actually, so it is not field tested. Just
+# including it here because it would be so juicy to find
+def tagUserPassword(elementDict, key, values):
+	addTag(elementDict, "#Creds because of #UserPasswordAttribute. This is a #HighImportance finding!")
+
+# The attributes we enrich once an element has been read in, and the
+# function that handles each. Each attribute is looked up once and its
+# values handed straight to the handler, along with the element itself
+# (handler(elementDict, attribute, values)). This is a tuple rather than
+# a dict so the tags come out in the same order every time.
+attributeHandlers = (
+	('member', updateListEntryInDict),
+	('memberof', updateListEntryInDict),
+	('logoncount', tagLowLogonCount),
+	('pwdlastset', updateTimeEntryInDict),
+	('badpasswordtime', updateTimeEntryInDict),
+	('lastlogon', updateTimeEntryInDict),
+	('lastlogontimestamp', updateTimeEntryInDict),
+	('useraccountcontrol', tagUserAccountControl),
+	('userpassword', tagUserPassword),
+)
 
 # Func to be run on group objects with admincount=1. This function will
 # tag all 'heirs' of any admin group with "#GroupIsAdmin" if a group or
 # "IsAdmin" if a user.
 # Of note: this function needs to be called after groups are fully
 # populated.
-def tagAsAdmin(samaccountname, origin=True):
-	if origin:
-		global originname
-		originname = samaccountname
-	if groupDict[samaccountname]:
-		for member in groupDict[samaccountname].get('member'):
-#			mem = member.lower()
-			mem = member
-			if groupDict[mem]:
-				#mem = member.lower()
-				#print(mem)
-#				groupDict[mem]['tags'].append("#GroupIsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname.title())
-				groupDict[mem]['tags'].append("#GroupIsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname)
-				#print(groupDict[mem]['tags'])
-				#groupDict[member.lo
-				tagAsAdmin(mem, False)
-			if userDict[mem]:
-#				userDict[mem]['tags'].append("#IsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname.title())
-				userDict[mem]['tags'].append("#IsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname)
-				#print("#IsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname.title())
-				#print(userDict[mem]['tags'])
-			if computerDict[mem]:
-#				computerDict[mem]['tags'].append("#ComputerIsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname.title())
-				computerDict[mem]['tags'].append("#ComputerIsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname)
-#		print(member)
-
-
-
-def writeData(dictOfUserGroup_or_Computer):
+# Groups are walked breadth first off a queue rather than by recursing, and
+# each group is only expanded once per admin group we start from. AD
+# nesting is often circular (Domain Admins in Administrators in Domain
+# Admins) which used to recurse forever, and overlapping nesting used to
+# re-walk the same groups over and over.
+def tagAsAdmin(originname):
+	queue = collections.deque([originname])
+	visited = set()
+	while queue:
+		samaccountname = queue.popleft()
+		if samaccountname in visited:
+			continue
+		visited.add(samaccountname)
+		# .get() rather than groupDict[name], so a name that was never
+		# parsed (a member from outside the dump, say) is just skipped
+		group = groupDict.get(samaccountname)
+		if group:
+			for member in group.get('member', ()):
+#				mem = member.lower()
+				mem = member
+				if groupDict.get(mem):
+					#print(mem)
+					addTag(groupDict[mem], "#GroupIsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname)
+					#print(groupDict[mem]['tags'])
+					if mem not in visited:
+						queue.append(mem)
+				if userDict.get(mem):
+					addTag(userDict[mem], "#IsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname)
+					#print(userDict[mem]['tags'])
+				if computerDict.get(mem):
+					addTag(computerDict[mem], "#ComputerIsAdmin based on group parentage tied to admincount=1, ultimately derived from membership in " + originname)
+
+
+
+# Links a member or parent to its group, computer or user note. Anything
+# we don't know about gets passed through as is, which catches the case
+# where a user drops extra data in the members or parents field of a
+# file we're appending to.
+# Which folder a name links into comes from memberLinkPrefixes, built
+# once before writing, so each member costs one lookup rather than a
+# lookup in each of the three dicts
+def linkMember(mem):
+	prefix = memberLinkPrefixes.get(mem)
+	if prefix:
+		return prefix + safeFileName(mem) + "]]"
+	return mem
+
+# Renders one user, group or computer out to the text of its .md file
+def renderData(obj):
+	# Every section is collected here and handed back as one string,
+	# so the file can be written with a single call rather than paying
+	# for a write per section
+	parts = []
+	#print(userFile)
+#	print(''.join(userDict[key][rawdata]))
+	#print(userDict[key]['rawdata'])
+	
+	## Create the raw data block. The lines are joined in one go and
+	# the header and code fence wrapped around them, which leaves the
+	# stored rawdata list alone
+	parts.append(rawDataStart + '\n'.join(obj['rawdata'][0]) + "\n```")
+	
+	## Write the members, each on its own line under the header. A
+	# generator feeds the join directly so no list of links gets built
+	# (and then shuffled to fit the header in at the front)
+	parts.append(membersStart + ''.join("\n" + linkMember(mem) for mem in obj.get('member', ())))
+	
+	## Write the parents. Users won't have members, so we won't
+	# bother with that
+	parts.append(parentsStart + ''.join("\n" + linkMember(parent) for parent in obj.get('memberof', ())))
+		
+		
+	## Write the tags. The same tag can be handed out more than once,
+	# for example when an admin group is reachable down two paths, so
+	# drop repeats here in one pass (keeping the order they came in)
+	# rather than searching the list every time a tag is added
+	if obj.get('tags'):
+		parts.append(tagsStart + "\n" + '\n'.join(dict.fromkeys(obj['tags'])))
+	else:
+		parts.append(tagsStart)
+		
+	## Write the useraccountcontrol values
+	if obj.get('uacval'):
+		'''
+		uac = obj['uacval']
+		print(uac)
+		targetFile.write("\n" + headers['uac'])
+		targetFile.write("\n[[UserAccountControlValues#")
+		targetFile.write(']]\n[[UserAccountControlValues#'.join(uac))
+		targetFile.write("]]")
+		'''
+		
+		
+		#print(obj['uacval'])
+		uac = obj['uacval']
+		#print(uac)
+		newU = []
+		#print(uac)
+		parts.append(uacStart)
+		for u in uac:
+			if u in uacLinks:
+				newU.append(uacLinks[u])
+			elif u.upper().startswith("ADS"):
+				newU.append(linkUACAttributes(u))
+			else:
+			#elif u != '\n':
+				#print(u)
+				newU.append(u)
+				#print(u)
+		parts.append('\n'.join(newU))
+		#print(newU)
+		#targetFile.write("\n[[UserAccountControlValues#")
+		#targetFile.write(']]\n[[UserAccountControlValues#'.join(uac))
+		#targetFile.write('\n'.join(newU))
+		#targetFile.write("]]")
+		#uac.insert(0, "\n# UserAccountControl values:")
+		#userFile.write("[[UserAccountControlValues#")
+		#userFile.write('\n[[UserAccountControlValues#'.join(uac))
+		#userFile.write("]]")
+		#userFile.write('\n'.join(uac))
+		#print(uac)
+	# If the list uacval doesn't exist, then just write the
+	# header for useraccountcontrol values and a newline
+	else:
+		parts.append(uacStart)
+		
+	## Write the clean timestamps
+	#if userDict[key][convertedTime]
+	cleanTimeStamps = []
+	for i in timeAttributes:
+		# Converted timestamps are stored as a string, anything that
+		# couldn't be converted is still the original list of values
+		if isinstance(obj.get(i), str):
+			cleanTimeStamps.append(timePrefixes[i] + obj[i])
+	cleanTimeStamps.insert(0, timeStart)
+	parts.append('\n'.join(cleanTimeStamps))
+		#else:
+		#	targetFile.write("\n" + headers['time'])
+	if obj.get('cleantime'):
+		parts.append("\n")
+		parts.append('\n'.join(obj['cleantime']))
+
+	# Write the User Defined section header
+	parts.append(userDefinedStart)
+	if obj.get('userDefined'):
+		parts.append('\n'.join(obj['userDefined']))
+	return ''.join(parts)
+
+def writeMarkdownFile(targetFile, content):
+	with open(targetFile, "w", buffering=1 << 20) as fh:
+		fh.write(content)
+
+# Renders and writes one file. Run on the writer threads, since by the
+# time anything is written everything renderData reads is finished with
+def renderAndWrite(targetFile, obj):
+	writeMarkdownFile(targetFile, renderData(obj))
+
+# Merges the data already in a group's .md file into the group's entry
+# in groupDict, so that append doesn't lose anything that was there
+# before. lines can be the open file itself: it is only read through
+# once, so the file never has to be copied into a list first
+def mergeExistingGroup(key, lines):
+	# Walk the existing file once, splitting it up into sections
+	# on the header lines. A section runs until the next line
+	# starting with "# ", except for User Defined, which runs to
+	# the end of the file so users can put their own headers in it.
+	# Blank lines are only kept in User Defined, where the user may have
+	# put them on purpose; anywhere else they're just spacing we wrote
+	sections = collections.defaultdict(list)
+	section = None
+	userDefinedHeader = headers['userDefined']
+	for l in lines:
+		stripped = l.strip()
+		if section != userDefinedHeader and stripped.startswith("# "):
+			if stripped in headerVals:
+				section = stripped
+			else:
+				section = None
+		elif section and (stripped or section == userDefinedHeader):
+			sections[section].append(stripped)
+	
+	# The group's record and the lists we add to are looked up once and
+	# kept in locals, rather than going back through groupDict[key] for
+	# every line merged
+	group = groupDict[key]
+	
+	## Raw data. Only the lines inside the code fence are data
+	oldRawData = fencedLines(sections[headers['rawdata']])
+	rawData = group['rawdata'][0]
+	# The set mirrors the new rawdata so each check is O(1)
+	# rather than a scan of the whole list
+	seenRawData = set(rawData)
+	for data in oldRawData:
+		# If there are any elements in oldRawData that don't
+		# exist in our new data, then we want to append those to
+		# our new data.
+		if data not in seenRawData:
+			seenRawData.add(data)
+			rawData.insert(-1,data)
+	
+	## Members and parents. These were written as links, so strip
+	# them back to the bare name before comparing with the new data
+	for header, dictKey in ((headers['members'], 'member'), (headers['parents'], 'memberof')):
+		names = group.setdefault(dictKey, [])
+		# Links were written with the filename-safe form of each name,
+		# so that is what reading them back gives us
+		seen = set(names)
+		seen.update(safeFileName(name) for name in names)
+		for data in sections[header]:
+			link = wikiLinkPattern.match(data)
+			if link:
+				data = link.group(1)
+			if data not in seen:
+				seen.add(data)
+				names.append(data)
+	
+	## Tags
+	tags = group.setdefault('tags', [])
+	seenTags = set(tags)
+	for data in sections[headers['tags']]:
+		if data not in seenTags:
+			seenTags.add(data)
+			tags.append(data)
+	
+	## UserAccountControl values. The old section holds the flags we
+	# rendered last time, as links, so skip any line that is how one of
+	# this run's flags gets written (or that we've already kept).
+	# Otherwise every append would add another copy of the flags
+	uacval = group.setdefault('uacval', [])
+	seenUAC = set(uacval)
+	seenUAC.update(uacLinks[name] for name in uacval if name in uacLinks)
+	for data in sections[headers['uac']]:
+		if data not in seenUAC:
+			seenUAC.add(data)
+			uacval.append(data)
+	
+	## Clean timestamps. The section in the old file starts with the
+	# stamps we wrote last time, and renderData writes this run's stamps
+	# ahead of whatever is kept here, so drop any line that is one of
+	# this run's stamps or that we've already kept. Otherwise every
+	# append would add another copy of the same timestamps
+	seenTime = {timePrefixes[i] + group[i] for i in timeAttributes if isinstance(group.get(i), str)}
+	cleantime = group.setdefault('cleantime', [])
+	seenTime.update(cleantime)
+	for data in sections[headers['time']]:
+		if data not in seenTime:
+			seenTime.add(data)
+			cleantime.append(data)
+	
+	## User defined. Keep everything, blank lines included. The
+	# leading empty entry puts the first line back under the header
+	userDefined = group.setdefault('userDefined', [])
+	userDefined.append('')
+	userDefined.extend(sections[headers['userDefined']])
+
+# Records that targetFile is being written for key. If some other key got
+# there first it keeps the file (first key wins), we warn, and hand back
+# False so the caller leaves the file alone
+def claimFile(claimedFiles, targetFile, key):
+	owner = claimedFiles.setdefault(targetFile, key)
+	if owner != key:
+		print("[!] " + key + " and " + owner + " both map to " + targetFile + ". Only " + owner + " is written.")
+		return False
+	return True
+
+# Writes every entry of the dict out to its own file under targetPath.
+# claimedFiles maps each file already spoken for (by the append code) to
+# the key it belongs to, and alreadyWritten holds the keys that have
+# been written out by that other route and so should be left alone.
+# The writes are queued on pool, and the pending writes are handed back
+# so the caller can check them once everything has been queued
+def writeData(dictOfUserGroup_or_Computer, targetPath, pool, claimedFiles=None, alreadyWritten=()):
 	keys = dictOfUserGroup_or_Computer.keys()
 	keys = list(keys)
-	if dictOfUserGroup_or_Computer == userDict:
-		targetPath = userPath
-	elif dictOfUserGroup_or_Computer == groupDict:
-		targetPath = groupPath
-	elif dictOfUserGroup_or_Computer == computerDict:
-		targetPath = computerPath
-	else:
-		print("Please specifiy an appropriate dictionary. You should only ever see this message if you have tweaked the code and broken something therein.")
+	# Rendering, opening and writing each file are all handed off to the
+	# pool, so the disk latency of one file overlaps with rendering the
+	# next and this loop only has to queue them up
+	pendingWrites = []
+	# Which key each file is being written for. Two names can come out
+	# the same once they're made filename safe, and two pool jobs writing
+	# over the same file at once could leave it a mess of both
+	claimedFiles = dict(claimedFiles or {})
 	for key in keys:
-		if len(dictOfUserGroup_or_Computer[key]) > 0:
+		if len(dictOfUserGroup_or_Computer[key]) > 0 and key not in alreadyWritten:
 #		if key == "administrators":
 			#
-			targetFile = targetPath + "/" + key + ".md"
-			targetFile = open(targetFile, "w")
-			#print(userFile)
-#			print(''.join(userDict[key][rawdata]))
-			#print(userDict[key]['rawdata'])
-			
-			## Create the raw data and write it
-			raw = dictOfUserGroup_or_Computer[key]['rawdata'][0]
-			raw.insert(0,"\n```plaintext raw")
-			raw.insert(0, headers['rawdata'])
-			raw.append("```")
-			raw = '\n'.join(raw)
-			#print(raw)
-			targetFile.write(raw)
-			
-			## Write the members.
-			if dictOfUserGroup_or_Computer[key]['member']:
-				members = dictOfUserGroup_or_Computer[key]['member']
-				#print(members)
-				mems = []
-				for mem in members:
-					#print(mem)
-					#if mem is a group:
-					linkedMem = ''
-					if groupDict[mem]:
-						#print(linkGroups(mem))
-						mems.append(linkGroups(mem))
-						#print(linkGroups(mem))
-					elif computerDict[mem]:
-						#print(linkComputers(mem))
-						mems.append(linkComputers(mem))
-					elif userDict[mem]:
-						#print(linkUsers(mem))
-						mems.append(linkUsers(mem))
-					# This Else catches exceptions where a user drops
-					# extra data in the members field in our append
-					# function
-					else:
-						mems.append(mem)
-				mems.insert(0, "\n" + headers['members'])
-				mems = '\n'.join(mems)
-				targetFile.write(mems)
-			else:
-				targetFile.write("\n" + headers['members'])
-				#print(mems)
-			
-			## Write the parents. Users won't have members, so we won't
-			# bother with that
-			if dictOfUserGroup_or_Computer[key]['memberof']:
-				parents = dictOfUserGroup_or_Computer[key]['memberof']
-				pars = []
-				for parent in parents:
-					#print(mem)
-					#if mem is a group:
-					linkedParent = ''
-					if groupDict[parent]:
-						#print(linkGroups(parent))
-						pars.append(linkGroups(parent))
-						#print(linkGroups(parent))
-					elif computerDict[parent]:
-						#print(linkComputers(parent))
-						pars.append(linkComputers(parent))
-					elif userDict[parent]:
-						#print(linkUsers(parent))
-						pars.append(linkUsers(parent))
-					# This Else catches exceptions where a user drops
-					# extra data in the parents field in our append
-					# function
-					else:
-						pars.append(parent)
-				#print(pars)
-				pars.insert(0, "\n" + headers['parents'])
-				pars = '\n'.join(pars)
-				#print(pars)
-				targetFile.write(pars)
-				#print(mems)
-			else:
-				targetFile.write("\n" + headers['parents'])
-				
-				
-			## Write the tags
-			if dictOfUserGroup_or_Computer[key]['tags']:
-				tags = dictOfUserGroup_or_Computer[key]['tags']
-				tags.insert(0, "\n" + headers['tags'])
-				targetFile.write('\n'.join(tags))
-			else:
-				targetFile.write("\n" + headers['tags'])
-				
-			## Write the useraccountcontrol values
-			if dictOfUserGroup_or_Computer[key]['uacval']:
-				'''
-				uac = dictOfUserGroup_or_Computer[key]['uacval'][0]
-				print(uac)
-				targetFile.write("\n" + headers['uac'])
-				targetFile.write("\n[[UserAccountControlValues#")
-				targetFile.write(']]\n[[UserAccountControlValues#'.join(uac))
-				targetFile.write("]]")
-				'''
-				
-				
-				#print(dictOfUserGroup_or_Computer[key]['uacval'])
-				uac = dictOfUserGroup_or_Computer[key]['uacval'][0]
-				#print(uac)
-				newU = []
-				#print(uac)
-				targetFile.write("\n" + headers['uac'] + "\n")
-				for u in uac:
-					if u.upper().startswith("ADS"):
-						newU.append("[[UserAccountControlValues#" + u + "]]")
-					else:
-					#elif u != '\n':
-						#print(u)
-						newU.append(u)
-						#print(u)
-				targetFile.write('\n'.join(newU))
-				#print(newU)
-				#targetFile.write("\n[[UserAccountControlValues#")
-				#targetFile.write(']]\n[[UserAccountControlValues#'.join(uac))
-				#targetFile.write('\n'.join(newU))
-				#targetFile.write("]]")
-				#uac.insert(0, "\n# UserAccountControl values:")
-				#userFile.write("[[UserAccountControlValues#")
-				#userFile.write('\n[[UserAccountControlValues#'.join(uac))
-				#userFile.write("]]")
-				#userFile.write('\n'.join(uac))
-				#print(uac)
-			# If the list uacval doesn't exist, then just write the
-			# header for useraccountcontrol values and a newline
-			else:
-				targetFile.write("\n" + headers['uac'] + "\n")
-				
-			## Write the clean timestamps
-			#if userDict[key][convertedTime]
-			cleanTimeStamps = []
-			for i in ['pwdlastset', 'badpasswordtime', 'lastlogon', 'lastlogontimestamp']:
-				if type(dictOfUserGroup_or_Computer[key][i]) != list:
-					cleanTimeStamps.append(i + delimiter	+ dictOfUserGroup_or_Computer[key][i])
-			cleanTimeStamps.insert(0, "\n" + headers['time'])
-			targetFile.write('\n'.join(cleanTimeStamps))
-				#else:
-				#	targetFile.write("\n" + headers['time'])
-			if dictOfUserGroup_or_Computer[key]['cleantime']:
-				targetFile.write("\n")
-				targetFile.write('\n'.join(dictOfUserGroup_or_Computer[key]['cleantime']))
-
-			# Write the User Defined section header
-			targetFile.write("\n" + headers['userDefined'])
-			if dictOfUserGroup_or_Computer[key]['userDefined']:
-				targetFile.write('\n'.join(dictOfUserGroup_or_Computer[key]['userDefined']))
-			targetFile.close()
+			targetFile = targetPath + "/" + safeFileName(key) + ".md"
+			if not claimFile(claimedFiles, targetFile, key):
+				continue
+			pendingWrites.append(pool.submit(renderAndWrite, targetFile, dictOfUserGroup_or_Computer[key]))
+	return pendingWrites
 
 
 
@@ -454,19 +686,104 @@ def writeData(dictOfUserGroup_or_Computer):
 
 
 
-# Long term storage for the whole dataset
-#groupDict = {}
-groupDict = collections.defaultdict(list)
-#userDict = {}
-userDict = collections.defaultdict(list)
-#computerDict = {}
-computerDict = collections.defaultdict(list)
-
-# Ephemeral storage per element
-elementDict = collections.defaultdict(list)
-
-
-
+# Long term storage for the whole dataset. These are plain dicts so that
+# looking up a name that isn't there (a member we never parsed, say)
+# can't quietly add an empty entry for it; check with .get() or "in"
+groupDict = {}
+userDict = {}
+computerDict = {}
+
+
+
+
+# Reads an input file in one go and hands back its text
+def readInputFile(path):
+	with open(path, 'r', encoding='utf-8-sig') as f:
+		return f.read()
+
+# Splits the text of one input file up into its elements, handing back
+# a dict of attribute name -> list of values for each one as soon as its
+# divider line is reached. Nothing is collected up, so only the element
+# being worked on is held here. This is the loop that runs for every
+# line of every file, so it lives in a function: names local to a
+# function are looked up much faster than globals, and the globals it
+# uses on every line are copied into locals up front.
+def iterElements(text):
+	delim = delimiter
+	intern = sys.intern
+	element = {}
+	#subpath = "/USERS"
+	# initialize rawdata. This list will hold raw data
+	rawdata = []
+	# The whole file was read in one go, so split it into lines in a
+	# single call rather than pulling it in a line at a time. An
+	# empty line is added on the end so the last element gets
+	# finished off even if the file has no blank line after it
+	lines = text.split("\n")
+	lines.append('')
+	for line in lines:
+		line = line.strip()
+		# Extra blank lines (two in a row between elements, or
+		# at the end of the file) have nothing to finish off, so
+		# skip them
+		if not line and not element:
+			continue
+		rawdata.append(line)
+	
+		# Split each line at the first delimiter, with the attr name
+		# before it and the attr value after it. partition always hands
+		# back three parts, so there's no list to build, and a value
+		# that has the delimiter in it (a description like "Note: old
+		# account") is kept whole rather than stopping the run
+#			line = line.lower().strip().split(delimiter)
+		attr, found, value = line.partition(delim)
+		if found:
+			# There are only so many attribute names, but every line
+			# hands back a new copy of its name. Interning means every
+			# element shares the one copy of each name as its dict key
+			element.setdefault(intern(attr), []).append(value)
+			#print(element)
+	
+		# This else condition should always and only occur when
+		# there is no delimiter in the line, which is the expected
+		# outcome for an empty line which should be separating
+		# elements. The element is finished, so hand it back and start
+		# on the next one
+		else:
+			#print(''.join(rawdata))
+			element['rawdata'] = [rawdata]
+			yield element
+			element = {}
+			rawdata = []
+
+# Works over a finished element (elementDict) and files it
+# into groupDict, userDict or computerDict. At this point, we are going
+# to conduct some operations on values of our dict and we are going to
+# set some new keys like tags and append values to them.
+# There is a pre-determined number of attributes, so this isn't killing
+# us on complexity. It is much more important to conserve our for loops,
+# and be very stingy with anything dealing with members or iterating
+# through users! Since there can be scads of those.
+# source is the files key of the input file the element came from.
+def fileElement(elementDict, source):
+	# Clean up members and parents, convert the ugly windows
+	# time values to pretty timestamps (tagging stale logons
+	# on the way), decode useraccountcontrol and apply all of
+	# the tags that go with those
+	for attribute, handler in attributeHandlers:
+		values = elementDict.get(attribute)
+		if values:
+			handler(elementDict, attribute, values)
+
+	# objectclass holds a handful of values like "top",
+	# "person" and "user". Lowercase them into a set once so
+	# each of the checks is a single hashed lookup,
+	# whatever case the tool that produced the dump used
+	objectClasses = {oc.lower() for oc in elementDict.get('objectclass', ())}
+
+	# Add the dictionary to the dict it belongs in, with a key of the
+	# value of the filenameseed (defined as a var above) of elementDict
+	addToAppropriateDict(classifyElement(objectClasses, source), elementDict[filenameSeed][0], elementDict)
 
 # There are surely better ways to do this, but this initializes a list 
 # that we will loop through to get the input files.
@@ -492,168 +809,68 @@ if args.computers:
 	#files.append(args.computers)
 #print(elementDict)
 
-fileKeys = files.keys()
-fileKeys = list(fileKeys)
-for fi in fileKeys:
-	print("Reading from " + files[fi])
-	with open(files[fi], 'r', encoding='utf-8-sig') as f:
-		#subpath = "/USERS"
-		# initialize tags
-		tags = []
-		# initialize timestamp values:
-		time = []
-		# initialize rawdata. This list will hold raw data
-		rawdata = []
-		for line in f.readlines():
-			rawdata.append(line.strip())
-			
-			# Split each line along the delimiter into a list, with attr
-			# name at index 0 and attr value at index 1. And make lowercase
-			# and strip whitespace characters from the ends
-#			line = line.lower().strip().split(delimiter)
-			line = line.strip().split(delimiter)
-			#print(line)
-			#print(len(line))
-			if len(line) == 2:
-				elementDict[line[0]].append(line[1])
-				#print(elementDict)
-			
-			# Throw an error if len(line) is not 2 or 1
-			elif len(line) != 2 and len(line) != 1:
-				print("There was an error. len(line) returned " + str(len(line)) + " but that value should only be 2 or 1!\nMaybe check your delimiter value and confirm that your elements are separated by an empty line?")
-				exit()
-			
-			# This else condition should always and only occur when
-			# len(line) == 1, which is the expected outcome for an empty
-			# line which should be separating elements. At this point, we 
-			# are going to conduct some operations on values of our dict
-			# and we are going to set some new keys like tags and append 
-			# values to them.
-			# This would be slightly faster to do under the case where
-			# len(line) == 2, but since there is a pre-determined number
-			# of attributes, this isn't killing us on complexity. It is 
-			# much more important to conserve our for loops, and be very 
-			# stingy with anything dealing with members or iterating through
-			# users! Since there can be scads of those.
-			else:
-				#print(''.join(rawdata))
-				elementDict['rawdata'].append(rawdata)
-				
-				# If there are members, update the members as a clean list
-				# in the dictionary
-				if elementDict['member']:
-					updateListEntryInDict('member')
-					#print(elementDict['member'])
-				
-				# If there are parents, update the parents as a clean list
-				# in the dictionary
-				if elementDict['memberof']:
-					updateListEntryInDict('memberof')
-				
-				if elementDict['logoncount']:
-					logoncount = int(elementDict['logoncount'][0])
-					#print(logoncount)
-					if logoncount < logonCountThreshold:
-						elementDict['tags'].append('#BadAccount due to #LowLogonCount at this Domain Controller')
-				
-				# Call function to run through a bunch of ugly windows time
-				# values and conver them to pretty timestamps.
-				# This function also tags stale logons
-				updateTimeEntryInDict(['pwdlastset', 'badpasswordtime', 'lastlogon', 'lastlogontimestamp'])
-				
-				# This chunk will look for useraccountcontrol values, call
-				# a function to calculate the relevant attributes, and 
-				# apply them as tags.
-				if elementDict['useraccountcontrol']:
-					#print(elementDict['useraccountcontrol'][0])
-					uacval = elementDict['useraccountcontrol'][0]
-					uacval = useraccountcalc(uacval)
-					# Create a new dictionary key of 'uacval' and add
-					# to it the value of uacval (a list)
-					elementDict['uacval'].append(uacval)
-					# Need to add a uacval entry into the dictionary.
-					#print(uacval)
-					if "ADS_UF_SMARTCARD_REQUIRED" in uacval:
-						elementDict['tags'].append("#SmartcardRequired")
-					if "ADS_UF_LOCKOUT" in uacval or "ADS_UF_ACCOUNTDISABLE" in uacval:
-						elementDict['tags'].append('#BadAccount due to #DisabledOrLockedAccount at this Domain Controller')
-					if "ADS_UF_PASSWORD_EXPIRED" in uacval:
-						elementDict['tags'].append('#BadAccount because #PasswordExpired at this Domain Controller')
-					if "ADS_UF_TRUSTED_TO_AUTHENTICATE_FOR_DELEGATION" in uacval or "ADS_UF_TRUSTED_FOR_DELEGATION" in uacval:
-						elementDict['tags'].append('#DelegationOpportunity')
-					if "ADS_UF_NORMAL_ACCOUNT" in uacval:
-						elementDict['tags'].append('#NormalAccount')
-					if "ADS_UF_SERVER_TRUST_ACCOUNT" in uacval:
-						elementDict['tags'].append("#ServerTrustAccount")
-				
-				# I haven't ever seen this, actually, so it is not field
-				# tested. Just including it here because it would be so
-				# juicy to find
-				if elementDict['userpassword']:
-					elementDict['tags'].append("#Creds because of #UserPasswordAttribute. This is a #HighImportance finding!")
-
-				# Check if something is a group
-				if isGroup():
-					#print("group!")
-					addToAppropriateDict(groupDict)
-				
-				# Check if something is a computer, and that it has all of
-				# the attributes of a computer, not just a user
-				# This gets the condition if this is a computer from Users
-				elif isComputerAsUser():
-					#print("Computer as user!")
-					addToAppropriateDict(computerDict)
-					
-				# In this case, I want to put it into my computerDict,
-				# but overwrite it if I find it as a computer
-				elif isComputerAsComputer():
-					addToAppropriateDict(computerDict)
-					''' #If you want to add a conditional in the event that you have already
-					# added that computer account with user attributes to computerDict,
-					# then uncomment this block and use the following two lines
-					if elementDict['samaccountname'][0] in computerDict:
-						print("found")
-					'''
-				# if none of the conditions (isGroup and isComputer*) are
-				# met, then it is a user
-				else:
-					#print("user!")
-					addToAppropriateDict(userDict)
-				#if elementDict['member']:
-				#	for member in elementDict["member"]:
-				#		#print(member)
-				
-
-
-					
-					
-			#if len(line) != 0:
-			#	data.append(line)
-			# If the line does not have content, then we know it is a divider
-				
-				# Set tags and members etc
-				# DO all enrichment here
-				# Write to file
-				# Add the dictionary to userDict with a key of the value of
-				# the filenameseed (defined as a var above) of elementDict, and the value of 
-				# elementDict itself
-				elementDict = collections.defaultdict(list)
-				rawdata = []
-		
-		# This loops through all of the group entries and if a group has
-		# admincount, runs our tagAsAdmin function
-		# We need to create a new variable "keys" and loop through that,
-		# Since we can't loop through a dictionary while it is changing size
-		keys = groupDict.keys()
-		keys = list(keys)
-		for key in keys:
-			# Check that admincount exists, and that the value is non-zero
-			if groupDict[key]['admincount'] and groupDict[key]['admincount'][0] != '0':
-				tagAsAdmin(groupDict[key]['samaccountname'][0])
+# With --cache, a run over the same input files (unchanged on disk) with
+# the same thresholds on the same day produces exactly the same data, so
+# load the dicts from the last run instead of parsing and tagging again.
+# The date is part of the key because stale logons depend on it. The key
+# is only worked out when --cache is given, and each file is only
+# stat'd once for it. The cache is plain JSON (not pickle), since loading
+# a pickle runs whatever code is in it and anyone who can write to the
+# vault could plant one. JSON has no tuples or dates, so the key is built
+# from lists and an ISO date string, which is what comes back on load
+loadedFromCache = False
+if args.cache:
+	fileStats = {fi: os.stat(files[fi]) for fi in files}
+	cacheKey = [cacheFormat, [[fi, files[fi], fileStats[fi].st_mtime_ns, fileStats[fi].st_size] for fi in files], delimiter, filenameSeed, logonCountThreshold, logonDateThreshold, date.today().isoformat()]
+	try:
+		with open(cacheFile, 'r', encoding='utf-8') as f:
+			cachedKey, cachedDicts = json.load(f)
+		if cachedKey == cacheKey:
+			groupDict, userDict, computerDict = cachedDicts
+			loadedFromCache = True
+			print("[+] Input files unchanged. Using cached data from " + cacheFile)
+	# A missing cache or one that isn't valid JSON (which covers a bad
+	# encoding, and unpacking the wrong number of things) just means we
+	# parse as normal
+	except (OSError, ValueError):
+		pass
+
+if not loadedFromCache:
+	fileKeys = files.keys()
+	fileKeys = list(fileKeys)
+	# With separate users, groups and computers files, read them all at
+	# the same time so the disk reads overlap. The parsing itself is
+	# still done one file at a time, in order, so nothing has to be
+	# locked around the dicts
+	with concurrent.futures.ThreadPoolExecutor(max_workers=len(fileKeys) or 1) as readers:
+		fileTexts = list(readers.map(readInputFile, [files[fi] for fi in fileKeys]))
+	for fi, text in zip(fileKeys, fileTexts):
+		print("Reading from " + files[fi])
+		# Each element is filed as soon as it has been read
+		for element in iterElements(text):
+			fileElement(element, fi)
+
+	# This loops through all of the group entries and if a group has
+	# admincount, runs our tagAsAdmin function. This runs once, after every
+	# input file has been read, so that groups split across files are fully
+	# populated and nothing gets tagged again for each file.
+	# We need to create a new variable "keys" and loop through that,
+	# Since we can't loop through a dictionary while it is changing size
+	keys = groupDict.keys()
+	keys = list(keys)
+	for key in keys:
+		# Check that admincount exists, and that the value is non-zero
+		if groupDict[key].get('admincount') and groupDict[key]['admincount'][0] != '0':
+			tagAsAdmin(groupDict[key]['samaccountname'][0])
+
+# Save the parsed and tagged data for next time. This happens before any
+# writing, since the append code merges existing files into groupDict
+if args.cache and not loadedFromCache:
+	os.makedirs(args.directory, exist_ok=True)
+	with open(cacheFile, 'w', encoding='utf-8') as f:
+		json.dump([cacheKey, [groupDict, userDict, computerDict]], f)
+	print("[+] Saved parsed data to " + cacheFile)
 
-#pickle.dump(userDict, open("filename.p", "wb"))
-#userDict2 = pickle.load(open("filename.p","rb"))
-#print(userDict2)
 
 
 
@@ -664,28 +881,32 @@ for fi in fileKeys:
 ##
 ########
 
-# Create directories at path if they don't already exist:
-if len(userDict) > 0:
-#	userPath = args.directory + "/USERS"
-	if not os.path.exists(userPath):
-		os.makedirs(userPath)
-		print("[+] Creating new directory at " + userPath)
-	else:
-		print("[+] " + userPath + " already exists. Using it now.")
-if len(groupDict) > 0:
-#	groupPath = args.directory + "/GROUPS"
-	if not os.path.exists(groupPath):
-		os.makedirs(groupPath)
-		print("[+] Creating new directory at " + groupPath)
-	else:
-		print("[+] " + groupPath + " already exists. Using it now.")
-if len(computerDict) > 0:
-#	computerPath = args.directory + "/COMPUTERS"
-	if not os.path.exists(computerPath):
-		os.makedirs(computerPath)
-		print("[+] Creating new directory at " + computerPath)
-	else:
-		print("[+] " + computerPath + " already exists. Using it now.")
+# Create directories at path if they don't already exist. Going straight
+# to makedirs (rather than checking os.path.exists first) is one less
+# filesystem call per directory and can't race with something else
+# creating it in between
+for path, dictOfUserGroup_or_Computer in ((userPath, userDict), (groupPath, groupDict), (computerPath, computerDict)):
+	if len(dictOfUserGroup_or_Computer) > 0:
+		try:
+			os.makedirs(path)
+			print("[+] Creating new directory at " + path)
+		except FileExistsError:
+			print("[+] " + path + " already exists. Using it now.")
+
+# Map every name we know about to the start of its link for linkMember.
+# Groups are filled in last so they win over a computer or user of the
+# same name, then computers over users, same as checking groupDict,
+# computerDict and userDict in that order would
+memberLinkPrefixes = {}
+for prefix, dictOfUserGroup_or_Computer in (("[[USERS/", userDict), ("[[COMPUTERS/", computerDict), ("[[GROUPS/", groupDict)):
+	for key in dictOfUserGroup_or_Computer:
+		memberLinkPrefixes[key] = prefix
+
+# One pool of writer threads is shared by everything below, so the
+# users can be rendered while the group files are still being written
+# rather than waiting for each batch to finish
+writePool = concurrent.futures.ThreadPoolExecutor(max_workers=writerThreads)
+pendingWrites = []
 
 #print(groupDict['Administrators']['member'])
 #####
@@ -694,9 +915,7 @@ if len(computerDict) > 0:
 ##
 #####
 if args.overwrite:
-	writeData(groupDict)
-	writeData(userDict)
-	writeData(computerDict)
+	pendingWrites += writeData(groupDict, groupPath, writePool)
 
 #####
 ##
@@ -705,260 +924,48 @@ if args.overwrite:
 #####
 
 elif args.append:
-	headerVals = headers.values()
-	headerVals = list(headerVals)
+	# Groups dealt with here (merged with, and written back over, their
+	# existing file, or skipped over a name collision we've already
+	# warned about), and which group each file belongs to. Files are claimed here in the
+	# same order writeData would, so the same group wins a collision and
+	# one group's note never gets merged into another's
+	appendedGroups = set()
+	claimedGroupFiles = {}
 	keys = groupDict.keys()
 	keys = list(keys)
 	#for key in groupDict.keys():
 	for key in keys:
-		indices = []
 		if len(groupDict[key]) > 0:
 # Debug line
 #		if key == "Administrators":
 			#print(key)
-			appendFile = groupPath + "/" + key + ".md"
-			with open(appendFile, 'r') as newfile:
-				lines = newfile.readlines()
-				totalLen = len(lines)
-				#print(lines)
-				for l in lines:
-					#if l.strip() in headerVals:
-						#indices.append(lines.index(l))
-					# This line checks if the the line is # Raw Data
-					if l.strip() in headerVals and "raw" in l.strip().lower():
-						# Start our index counter at 3, because that is
-						# how many values we need to offset to get the 
-						# first actual rawdata value and avoid "```" and
-						# "\n" and other garbage
-						count = 3
-						v = ''
-						oldRawData = []
-						# This loop runs until we hit the closing of the
-						# rawdata block. It iterates through each line
-						# and adds it into newRawData
-						while v.strip() != "```":
-							# This makes v equal to the new line 
-							v = lines[lines.index(l)+count]
-							# And this appends it to our list
-							oldRawData.append(v.strip())
-							# Iterates counter for next list item
-							count += 1
-							#print('\n'.join(newRawData[:-1]))
-							#print(newRawData[:-1])
-						# Looks through our rawdata list
-						for data in oldRawData[:-1]:
-							data = data.strip()
-							# If there are any elements in oldRawData
-							# that don't exist in our new data, then we
-							# want to append those to our new data.
-							if data not in groupDict[key]['rawdata'][0]:
-								groupDict[key]['rawdata'][0].insert(-1,data)
-#								print(groupDict)
-								#newRawData.insert()data + "\n" + oldRawData[count-1]
-#						for data in groupDict[key]['rawdata'][0]:
-#							if data not in oldRawData[:-1]:
-								
-
-					elif l.strip() in headerVals and "# Members" in l.strip():
-						#print(l)
-						
-						
-						# Start our index counter at 1, because that is
-						# how many values we need to offset to avoid  
-						# hitting ourselves
-						count = 1
-						v = ''
-						oldMembers = []
-						# This loop runs until we hit the next header
-						# block. It iterates through each line and adds
-						# it into oldMembers
-						while not v.strip().startswith("# "):
-							#print(v.strip())
-							# This makes v equal to the new line 
-							#print(count)
-							v = lines[lines.index(l)+count]
-							# And this appends it to our list
-							oldMembers.append(v.strip())
-							# Iterates counter for next list item
-							count += 1
-						# Looks through our old members list and 
-						# compares with new
-						#print('\n'.join(groupDict[key]['member']))
-						#print(oldMembers)
-						for data in oldMembers[:-1]:
-							data = data.strip()
-							#print(data)
-							if data.startswith("[[") and "/" in data:
-								data = data.split("/")[-1][:-2]
-							elif data.startswith("[["):
-								data = data[2:-2]								
-							#print(data)
-							# If there are any elements in oldMembers
-							# that don't exist in our new data, then we
-							# want to append those to our new data.
-							if data not in groupDict[key]['member']:
-								#print(data)
-								groupDict[key]['member'].append(data)
-								#print(groupDict[key]['member'])
-						#print('\n'.join(groupDict[key]['member']))
-								#groupDict[key]['member'].insert(-1,data)
-								#newRawData.insert()data + "\n" + oldRawData[count-1]
-
-
-					elif l.strip() in headerVals and "# Parents" in l.strip():
-						# Start our index counter at 1, because that is
-						# how many values we need to offset to avoid  
-						# hitting ourselves
-						#print(l)
-						count = 1
-						v = ''
-						oldParents = []
-						# This loop runs until we hit the next header
-						# block. It iterates through each line and adds
-						# it into oldMembers
-						while not v.strip().startswith("# "):
-							#print(v.strip())
-							# This makes v equal to the new line 
-							v = lines[lines.index(l)+count]
-							#print(v)
-							# And this appends it to our list
-							oldParents.append(v.strip())
-							# Iterates counter for next list item
-							count += 1
-						#print(oldParents)
-						# Looks through our old members list and 
-						# compares with new
-						#print(oldParents)
-						for data in oldParents[:-1]:
-							data = data.strip()
-							#print(data)
-							if data.startswith("[[") and "/" in data:
-								data = data.split("/")[-1][:-2]
-							elif data.startswith("[["):
-								data = data[2:-2]
-							#print(data)
-							# If there are any elements in oldMembers
-							# that don't exist in our new data, then we
-							# want to append those to our new data.
-							if data not in groupDict[key]['memberof']:
-								#print(data)
-								groupDict[key]['memberof'].append(data)
-								#newRawData.insert()data + "\n" + oldRawData[count-1]
-						#print('\n'.join(groupDict[key]['memberof']))
-						
-					elif l.strip() in headerVals and "# Tags" in l.strip():
-						# Start our index counter at 1, because that is
-						# how many values we need to offset to avoid  
-						# hitting ourselves
-						count = 1
-						v = ''
-						oldTags = []
-						# This loop runs until we hit the next header
-						# block. It iterates through each line and adds
-						# it into oldMembers
-						while not v.strip().startswith("# "):
-							#print(v.strip())
-							# This makes v equal to the new line 
-							v = lines[lines.index(l)+count]
-							# And this appends it to our list
-							oldTags.append(v.strip())
-							# Iterates counter for next list item
-							count += 1
-						#print(oldParents)
-						# Looks through our old members list and 
-						# compares with new
-						for data in oldTags[:-1]:
-							data = data.strip()
-							#print(data)
-							# If there are any elements in oldMembers
-							# that don't exist in our new data, then we
-							# want to append those to our new data.
-							if data not in groupDict[key]['tags']:
-								groupDict[key]['tags'].append(data)
-								#newRawData.insert()data + "\n" + oldRawData[count-1]
-						#print('\n'.join(groupDict[key]['memberof']))
-						
-						
-					elif l.strip() in headerVals and "# UserAccountControl Values" in l.strip():
-						# Start our index counter at 3, because that is
-						# how many values we need to offset to get the 
-						# first actual rawdata value and avoid "```" and
-						# "\n" and other garbage
-						count = 1
-						v = ''
-						oldUAC = []
-						newUAC = []
-						# This exists because of some bad code that I
-						# need to fix...
-						secondListWrapper = []
-						# This loop runs until we hit the closing of the
-						# rawdata block. It iterates through each line
-						# and adds it into newRawData
-						while not v.strip().startswith("# "):
-							# This makes v equal to the new line 
-							v = lines[lines.index(l)+count]
-							#print("v is: " + v.strip())
-							# And this appends it to our list
-							oldUAC.append(v.strip())
-							# Iterates counter for next list item
-							count += 1
-							#print('\n'.join(newRawData[:-1]))
-							#print(newRawData[:-1])
-						# Looks through our rawdata list
-						#print(
-						if groupDict[key]['uacval']:
-							#print("key is " + key)
-							#print("exists, and uacval is: ")
-							#print(uacval)
-							for u in uacval:
-								groupDict[key]['uacval'][0].append(u)
-							#print("exists")
-						else:
-							#print("orig is:")
-							#print(groupDict[key]['uacval'])
-							#for u in oldUAC:
-							groupDict[key]['uacval'].append(oldUAC[:-1])
-							#print("new is:")
-							#print(groupDict[key]['uacval'])
-						#oldUAC = oldUAC[:-1]
-
-					elif l.strip() in headerVals and "# Clean T" in l.strip():
-						count = 1
-						v = ''
-						oldTime = ["\n"]
-						currentLine = lines.index(l)
-						#print(currentLine)
-						#print(totalLen)
-						while not v.strip().startswith("# "):
-							#print(v.strip())
-							# This makes v equal to the new line 
-							v = lines[lines.index(l)+count]
-							# And this appends it to our list
-							oldTags.append(v.strip())
-							# Iterates counter for next list item
-							count += 1
-
-						for data in oldTags[:-1]:
-							data = data.strip()
-
-							groupDict[key]['cleantime'].append(data)
-
-					elif l.strip() in headerVals and "# User De" in l.strip():
-						count = 1
-						v = ''
-						userDef = ["\n"]
-						currentLine = lines.index(l)
-						#print(currentLine)
-						#print(totalLen)
-						while count <= totalLen-currentLine-1:
-							v = lines[lines.index(l)+count]
-							userDef.append(v.strip())
-							count += 1
-
-						for data in userDef:
-							data = data.strip()
-							#print("data is: "+data)
-							groupDict[key]['userDefined'].append(data)
-	writeData(groupDict)
-	writeData(userDict)
-	writeData(computerDict)
+			appendFile = groupPath + "/" + safeFileName(key) + ".md"
+			if not claimFile(claimedGroupFiles, appendFile, key):
+				appendedGroups.add(key)
+				continue
+			# The existing file is read, merged and rewritten through one
+			# handle so each file only gets opened once. Groups that
+			# don't have a file yet are left for writeData below
+			try:
+				newfile = open(appendFile, 'r+', buffering=1 << 20)
+			except FileNotFoundError:
+				continue
+			with newfile:
+				mergeExistingGroup(key, newfile)
+				newfile.seek(0)
+				newfile.write(renderData(groupDict[key]))
+				newfile.truncate()
+			appendedGroups.add(key)
+	pendingWrites += writeData(groupDict, groupPath, writePool, claimedGroupFiles, appendedGroups)
+
+# Only groups get merged when appending, so users and computers are
+# written out the same way whichever mode we're in. They all go on the
+# same pool as the groups, so it is one batch of writes either way
+if args.overwrite or args.append:
+	for dictOfUserGroup_or_Computer, targetPath in ((userDict, userPath), (computerDict, computerPath)):
+		pendingWrites += writeData(dictOfUserGroup_or_Computer, targetPath, writePool)
+
+writePool.shutdown(wait=True)
+# Raise any error from the pool here so a failed write isn't silent
+for write in pendingWrites:
+	write.result()